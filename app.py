@@ -5,147 +5,380 @@ import os
 os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
 os.environ["ORT_TENSORRT_ENGINE_CACHE_ENABLE"] = "0"
 
+import asyncio
+import hashlib
+import io
+import mmap
 import shutil
+import subprocess
+import tempfile
+import time
 import sys
+import importlib
+import importlib.metadata
 import importlib.util
-import requests
-import glob
+import platformdirs
+import httpx
 from pathlib import Path
-from pdf2image import convert_from_path
-from music21 import converter
-from midi2audio import FluidSynth
-from pydub import AudioSegment
+from xml.etree.ElementTree import ParseError
 from PIL import Image, ImageOps
 
 # --- CONFIGURATION ---
-SOUNDFONT_URL = "https://raw.githubusercontent.com/musescore/MuseScore/master/share/sound/FluidR3Mono_GM.sf3"
-SOUNDFONT_FILE = "FluidR3Mono_GM.sf3"
+# Compact (~6 MB) General MIDI bank: plain SF2 loads without per-render Vorbis decoding
+SOUNDFONT_URL = "https://musical-artifacts.com/artifacts/1176/TimGM6mb.sf2"
+# Downloaded artifacts are immutable: keep them in the user cache dir so they survive restarts
+CACHE_DIR = platformdirs.user_cache_dir("music-score-reader")
+SOUNDFONT_FILE = os.path.join(CACHE_DIR, "TimGM6mb.sf2")
+MODELS = {
+    # key: (checkpoint folder, url)
+    "unet_big": ("unet_big", "https://github.com/BreezeWhite/oemer/releases/download/checkpoints/1st_model.onnx"),
+    "seg_net":  ("seg_net",  "https://github.com/BreezeWhite/oemer/releases/download/checkpoints/2nd_model.onnx"),
+}
+RESULTS_DIR = os.path.join(CACHE_DIR, "results")  # MusicXML / MP3 keyed by input SHA-256 + config
+# oemer's resize_image rescales every input to ~3.675 MP (middle of its 3-4.35 MP band):
+# pixels beyond that are thrown away, and smaller inputs get upscaled by oemer itself
+OMR_TARGET_PIXELS = 3_675_000
+AUDIO_SAMPLE_RATE = 22050
+# Set USE_FP32_MODELS=1 to skip INT8 quantization (e.g. to A/B accuracy on a problem score)
+USE_FP32_MODELS = os.environ.get("USE_FP32_MODELS", "").lower() in ("1", "true", "yes")
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # Read size for streaming downloads to disk
+MP3_ENCODER_ARGS = ["-ac", "1", "-codec:a", "libmp3lame", "-q:a", "5"]
+RESULTS_VERSION = 1      # Bump when the pipeline changes in a way the result keys don't capture
+RESULTS_MAX_BYTES = 512 * 1024 * 1024
+RESULTS_MAX_AGE = 30 * 24 * 3600  # seconds since a result was last served
 
 # --- SYSTEM SETUP ---
-def download_file_with_progress(url, dest_path, description):
-    if os.path.exists(dest_path): return
-    st.write(f"⬇️ Downloading {description}...")
+def file_sha256(path):
+    # mmap lets hashlib (SHA-NI accelerated via OpenSSL) read the file without Python-level chunking
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0: return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+def is_intact(path):
+    """
+    True when path exists and still matches the SHA-256 recorded beside it when it was written,
+    i.e. it has not been corrupted since. Files without a record (fetched by an older version
+    of the app) are trusted and recorded now.
+    """
+    if not os.path.exists(path): return False
+    digest = file_sha256(path)
+    digest_path = path + ".sha256"
+    if not os.path.exists(digest_path):
+        with open(digest_path, "w") as f: f.write(digest)
+        return True
+
+    with open(digest_path, "r") as f:
+        if f.read().strip() == digest: return True
+    print(f"⚠️ Checksum mismatch: {path}")
+    return False
+
+def discard_artifact(path):
+    """
+    Deletes an artifact with its digest record and anything derived from it (the INT8 copy
+    of a model), so nothing built from a bad file outlives it.
+    """
+    paths = [path]
+    if path.endswith(".onnx") and not path.endswith(".int8.onnx"):
+        paths.append(path.replace(".onnx", ".int8.onnx"))
+    for p in paths:
+        for f in (p, p + ".sha256"):
+            if os.path.exists(f): os.remove(f)
+
+async def download_file(client, url, dest_path, progress):
+    """
+    Streams url to dest_path, recording [downloaded, total] bytes in `progress`.
+    The body goes to a .tmp file that only replaces dest_path once complete, so an interrupted
+    download never leaves a truncated file that later passes the existence check. Bytes are
+    hashed on the way through, so the SHA-256 record comes for free (no second pass).
+    """
+    tmp_path = dest_path + ".tmp"
+    sha256 = hashlib.sha256()
     try:
-        response = requests.get(url, stream=True)
-        total_size = int(response.headers.get('content-length', 0))
-        progress = st.progress(0)
-        downloaded = 0
-        with open(dest_path, "wb") as f:
-            for chunk in response.iter_content(1024*1024):
-                if chunk:
+        # Ask for the body as-is; should a host compress it anyway, aiter_bytes decodes it
+        async with client.stream("GET", url, headers={"Accept-Encoding": "identity"}) as response:
+            response.raise_for_status()
+            # Binary assets only: a complete HTML error/landing page must not become a cache hit
+            if response.headers.get("content-type", "").startswith("text/"):
+                raise IOError(f"unexpected {response.headers['content-type']} response")
+            progress[1] = int(response.headers.get("content-length", 0))
+            encoded = "content-encoding" in response.headers
+            with open(tmp_path, "wb") as f:
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
                     f.write(chunk)
-                    downloaded += len(chunk)
-                    if total_size > 0:
-                        progress.progress(min(downloaded / total_size, 1.0))
-        progress.empty()
+                    sha256.update(chunk)
+                    progress[0] += len(chunk)
+
+        # content-length is the encoded size, so only compare when the body was sent as-is
+        if progress[1] and not encoded and os.path.getsize(tmp_path) != progress[1]:
+            raise IOError(f"incomplete download ({os.path.getsize(tmp_path)} of {progress[1]} bytes)")
+        os.replace(tmp_path, dest_path)
+        with open(dest_path + ".sha256", "w") as f: f.write(sha256.hexdigest())
+    finally:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+
+async def fetch_all(pending, sizes, on_progress):
+    """
+    Runs every download on one event loop. With HTTP/2, requests to the same host are
+    multiplexed over a single TLS connection instead of one handshake per file.
+    """
+    async with httpx.AsyncClient(http2=True, follow_redirects=True, timeout=60.0,
+                                 limits=httpx.Limits(max_connections=4)) as client:
+        tasks = [asyncio.create_task(download_file(client, url, dest_path, size))
+                 for (url, dest_path, _), size in zip(pending, sizes)]
+        running = set(tasks)
+        while running:
+            _, running = await asyncio.wait(running, timeout=0.25)
+            on_progress()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+def download_files(tasks):
+    """
+    Fetches (url, dest_path, description) tasks concurrently; they are independent and network-bound.
+    Everything runs on the script thread, and the single progress bar is only redrawn
+    when the aggregate percentage changes.
+    """
+    with st.spinner("🔍 Verifying downloaded files..."):
+        pending = [task for task in tasks if not is_intact(task[1])]
+    if not pending: return
+    for _, dest_path, _ in pending:
+        discard_artifact(dest_path)
+
+    names = ", ".join(description for _, _, description in pending)
+    progress_bar = st.progress(0.0, text=f"⬇️ Downloading {names}...")
+    sizes = [[0, 0] for _ in pending]
+    last_pct = 0
+
+    def on_progress():
+        nonlocal last_pct
+        total_size = sum(total for _, total in sizes)
+        if total_size > 0:
+            pct = min(100 * sum(downloaded for downloaded, _ in sizes) // total_size, 100)
+            if pct != last_pct:
+                progress_bar.progress(pct / 100, text=f"⬇️ Downloading {names}...")
+                last_pct = pct
+
+    results = asyncio.run(fetch_all(pending, sizes, on_progress))
+    progress_bar.empty()
+    for (_, _, description), result in zip(pending, results):
+        if isinstance(result, Exception):
+            st.error(f"Failed to download {description}: {result}")
+            st.stop()
+
+def link_oemer_package(src_dir, target_path):
+    """
+    Builds a lightweight overlay of the installed oemer package instead of copying it:
+    every entry is symlinked except checkpoints/, which is copied (metadata only) so the
+    models can be downloaded next to it. oemer resolves checkpoints relative to its own
+    package dir, so this is enough to make them writable.
+    """
+    os.makedirs(target_path, exist_ok=True)
+    for entry in os.scandir(src_dir):
+        dest = os.path.join(target_path, entry.name)
+        if entry.name == "__pycache__" or os.path.exists(dest): continue
+        if os.path.islink(dest): os.remove(dest)  # dangling: its source was reinstalled/moved
+        if entry.name == "checkpoints":
+            shutil.copytree(entry.path, dest, ignore=shutil.ignore_patterns("*.onnx"))
+            continue
+        try:
+            os.symlink(entry.path, dest, target_is_directory=entry.is_dir())
+        except (OSError, NotImplementedError):
+            # No symlink support (e.g. Windows without developer mode): copy this entry instead
+            if entry.is_dir():
+                shutil.copytree(entry.path, dest)
+            else:
+                shutil.copy2(entry.path, dest)
+
+def quantize_model(file_path):
+    """
+    Writes a dynamically quantized INT8 copy next to an FP32 ONNX model (one-time cost).
+    INT8 kernels run 2-4x faster than FP32 on CPUs with AVX2/VNNI.
+    """
+    int8_path = file_path.replace(".onnx", ".int8.onnx")
+    if os.path.exists(int8_path): return
+
+    tmp_path = int8_path + ".tmp"
+    try:
+        # Needs the separate onnx package; without it this is skipped like any other failure
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(file_path, tmp_path, weight_type=QuantType.QUInt8)
+        os.replace(tmp_path, int8_path)
+        with open(int8_path + ".sha256", "w") as f: f.write(file_sha256(int8_path))
     except Exception as e:
-        st.error(f"Failed to download {description}: {e}")
-        st.stop()
+        # Not fatal: load_onnx_session falls back to the FP32 model
+        print(f"⚠️ Could not quantize {file_path}: {e}")
+        if os.path.exists(tmp_path): os.remove(tmp_path)
 
-def patch_oemer_code(base_dir):
+@st.cache_resource(show_spinner=False)
+def load_onnx_session(model_path):
     """
-    Scans the local oemer copy and removes references to CUDA to prevent ONNX errors.
+    Builds one fully-optimized CPU session per model file and keeps it for the process lifetime.
     """
-    for filepath in glob.glob(os.path.join(base_dir, "**/*.py"), recursive=True):
-        with open(filepath, "r", encoding="utf-8") as f:
-            content = f.read()
-        
-        # Patch: Remove CUDAExecutionProvider from the list
-        if "CUDAExecutionProvider" in content:
-            # Replace the list with just CPU
-            # Handles different formatting (quotes, spaces)
-            new_content = content.replace("'CUDAExecutionProvider',", "") \
-                                 .replace('"CUDAExecutionProvider",', "") \
-                                 .replace("'CUDAExecutionProvider'", "") \
-                                 .replace('"CUDAExecutionProvider"', "")
-            
-            if content != new_content:
-                print(f"🔧 Patching GPU code in: {filepath}")
-                with open(filepath, "w", encoding="utf-8") as f:
-                    f.write(new_content)
+    import onnxruntime as ort
+
+    sess_opts = ort.SessionOptions()
+    sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    sess_opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    sess_opts.intra_op_num_threads = os.cpu_count() or 1
+    sess_opts.enable_mem_pattern = True
+
+    # Prefer the INT8 copy produced by quantize_model when it exists
+    int8_path = model_path.replace(".onnx", ".int8.onnx")
+    if not USE_FP32_MODELS and os.path.exists(int8_path):
+        model_path = int8_path
+
+    print(f"🧠 Loading ONNX model: {model_path}")
+    return ort._uncached_inference_session(model_path, sess_options=sess_opts, providers=["CPUExecutionProvider"])
+
+def install_onnx_session_cache(model_paths):
+    """
+    oemer builds a new InferenceSession (graph parse + optimization) on every run.
+    Route its checkpoints through load_onnx_session so each model is only loaded once;
+    every other model (other paths, bytes, custom options) is constructed as usual.
+    The class is patched once; later calls only add to the set of cached paths.
+    """
+    import onnxruntime as ort
+    if not hasattr(ort, "_uncached_inference_session"):
+        class InferenceSession(ort.InferenceSession):
+            # Lives on the class, not in this script's globals, which Streamlit rebuilds every rerun
+            cached_paths = set()
+
+            def __new__(cls, path_or_bytes, *args, **kwargs):
+                # A cached session is a plain ort session, so Python skips __init__ for it
+                if isinstance(path_or_bytes, (str, os.PathLike)) and os.path.abspath(path_or_bytes) in cls.cached_paths:
+                    return load_onnx_session(os.path.abspath(path_or_bytes))
+                return super().__new__(cls)
 
+        ort._uncached_inference_session = ort.InferenceSession
+        ort.InferenceSession = InferenceSession
+
+    ort.InferenceSession.cached_paths.update(os.path.abspath(p) for p in model_paths)
+
+@st.cache_resource(show_spinner=False)
 def setup_environment():
-    # 1. Download SoundFont
-    download_file_with_progress(SOUNDFONT_URL, SOUNDFONT_FILE, "SoundFont")
+    # 1. Setup Local Oemer
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    spec = importlib.util.find_spec("oemer")
+    if spec is None:
+        st.error("oemer library not found.")
+        st.stop()
 
-    # 2. Setup Local Oemer
-    local_oemer_dir = "oemer_local"
+    # The cache dir is shared by every environment, so each oemer install gets its own overlay
+    src_dir = os.path.dirname(spec.origin)
+    install_key = hashlib.sha256(f"{src_dir}|{package_version('oemer')}".encode()).hexdigest()[:12]
+    local_oemer_dir = os.path.join(CACHE_DIR, "oemer_local", install_key)
     target_path = os.path.join(local_oemer_dir, "oemer")
-    
-    if not os.path.exists(target_path):
-        with st.spinner("Setting up AI Engine code..."):
-            spec = importlib.util.find_spec("oemer")
-            if spec is None:
-                st.error("oemer library not found.")
-                st.stop()
-            
-            # Copy system oemer to local
-            shutil.copytree(os.path.dirname(spec.origin), target_path, dirs_exist_ok=True)
-            
-            # RUN THE CODE PATCHER
-            patch_oemer_code(target_path)
+
+    # Runs every time (once per process): existing entries are skipped, so an overlay left
+    # half-built by an interrupted setup is completed instead of reused as-is
+    with st.spinner("Setting up AI Engine code..."):
+        # Overlay system oemer locally (GPU providers are already kept out by load_onnx_session)
+        link_oemer_package(src_dir, target_path)
 
     # Add to path
     if os.path.abspath(local_oemer_dir) not in sys.path:
         sys.path.insert(0, os.path.abspath(local_oemer_dir))
 
-    # 3. Manual Model Download
+    # 2. Download SoundFont + Models (in parallel)
     base_ckpt_dir = os.path.join(target_path, "checkpoints")
-    models = {
-        "unet_big": ("unet_big", "https://github.com/BreezeWhite/oemer/releases/download/checkpoints/1st_model.onnx"),
-        "seg_net":  ("seg_net",  "https://github.com/BreezeWhite/oemer/releases/download/checkpoints/2nd_model.onnx")
-    }
-    
-    for key, (folder, url) in models.items():
+    model_files = {}
+    for key, (folder, url) in MODELS.items():
         folder_path = os.path.join(base_ckpt_dir, folder)
         os.makedirs(folder_path, exist_ok=True)
-        file_path = os.path.join(folder_path, "model.onnx")
-        if not os.path.exists(file_path):
-            download_file_with_progress(url, file_path, f"AI Model: {key}")
+        model_files[key] = os.path.join(folder_path, "model.onnx")
+
+    download_files([(SOUNDFONT_URL, SOUNDFONT_FILE, "SoundFont")] +
+                   [(url, model_files[key], f"AI Model: {key}") for key, (_, url) in MODELS.items()])
+
+    # 3. Quantize models to INT8 (one-time; a damaged INT8 copy is rebuilt from the verified model)
+    for key, file_path in model_files.items():
+        int8_path = file_path.replace(".onnx", ".int8.onnx")
+        if os.path.exists(int8_path) and not is_intact(int8_path):
+            discard_artifact(int8_path)
+        if not USE_FP32_MODELS and not os.path.exists(int8_path):
+            with st.spinner(f"Optimizing AI Model: {key}..."):
+                quantize_model(file_path)
+
+    # 4. Reuse ONNX sessions across runs, and build them now rather than on the first click
+    install_onnx_session_cache(model_files.values())
+    with st.spinner("Loading AI models..."):
+        for file_path in model_files.values():
+            load_onnx_session(os.path.abspath(file_path))
 
 # --- CORE PROCESSING ---
+def omr_scale(width, height):
+    """
+    Scale factor (<= 1) that brings a width x height image down to OMR_TARGET_PIXELS.
+    """
+    return min(1.0, (OMR_TARGET_PIXELS / (width * height)) ** 0.5)
+
 class MusicConverter:
+    _parser = False  # MusicXML -> MIDI backend module, resolved on first use
+    _setup_done = False
+
     def __init__(self):
-        setup_environment()
+        # Backstop for instances built outside get_converter(): skip even the cache lookup
+        if not MusicConverter._setup_done:
+            setup_environment()
+            MusicConverter._setup_done = True
         self.soundfont = SOUNDFONT_FILE
+        # Import once setup has put the local oemer on sys.path; reused by every run_omr
+        self._oemer_ete = importlib.import_module("oemer.ete")
 
     def prepare_image(self, file_bytes, file_name, temp_dir):
-        output_path = os.path.join(temp_dir, "input_score.png")
+        output_path = os.path.join(temp_dir, "input_score.bmp")
         if file_name.lower().endswith(".pdf"):
-            temp_pdf = os.path.join(temp_dir, "temp.pdf")
-            with open(temp_pdf, "wb") as f: f.write(file_bytes)
-            # Use 200 DPI (faster than 300, usually sufficient)
-            images = convert_from_path(temp_pdf, first_page=1, last_page=1, dpi=200)
-            img = images[0]
+            import fitz  # PyMuPDF (only imported once a PDF is actually uploaded)
+
+            # Render in-process with PyMuPDF straight from the upload bytes (no temp PDF)
+            with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+                page = doc.load_page(0)
+                # Vector pages can be rasterized at exactly the size oemer works at (any DPI),
+                # so neither we nor oemer resample the page afterwards
+                zoom = (OMR_TARGET_PIXELS / (page.rect.width * page.rect.height)) ** 0.5
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+            img = Image.frombytes("L", (pix.width, pix.height), pix.samples)
         else:
-            temp_img = os.path.join(temp_dir, "temp_input")
-            with open(temp_img, "wb") as f: f.write(file_bytes)
-            img = Image.open(temp_img)
+            img = Image.open(io.BytesIO(file_bytes))
+
+            # Already a plain, small-enough PNG/JPEG: hand oemer the original bytes (no decode/re-encode)
+            if (img.format in ("PNG", "JPEG") and img.mode in ("L", "RGB")
+                    and omr_scale(*img.size) == 1.0
+                    and "icc_profile" not in img.info
+                    and img.getexif().get(0x0112, 1) == 1):  # no EXIF rotation pending
+                output_path = os.path.join(temp_dir, "input_score" + (".png" if img.format == "PNG" else ".jpg"))
+                with open(output_path, "wb") as f: f.write(file_bytes)
+                return output_path
+
+            # Decode straight from memory; honour camera EXIF orientation
+            img = ImageOps.exif_transpose(img)
 
-        # FIX: Convert to RGB and STRIP metadata (fixes libpng warning)
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
+        # Sheet music is bitonal: a single grayscale channel is all oemer needs
+        # (its loader expands to 3 channels itself). Also STRIPs metadata
+        if img.mode != 'L':
+            img = img.convert('L')
+
+        # Don't carry more pixels than oemer keeps; never upscale (oemer does that itself)
+        scale = omr_scale(*img.size)
+        if scale < 1.0:
+            img = img.resize((round(img.width * scale), round(img.height * scale)), Image.LANCZOS)
         
-        # Save without ICC profile to clean up the warning
-        img.save(output_path, "PNG", icc_profile=None)
+        # Transient file read once by oemer (cv2/PIL both decode BMP): skip compression entirely
+        img.save(output_path, "BMP")
         return output_path
 
     def run_omr(self, image_path):
-        import oemer.ete as oemer_ete
+        oemer_ete = self._oemer_ete
         print(f"🎵 Analyzing: {image_path}")
-        
-        # Mock CLI
-        original_argv = sys.argv
-        sys.argv = ["oemer", image_path]
 
+        # Call oemer's pipeline directly instead of faking its CLI (sys.argv + main()),
+        # which also re-checks checkpoints and renders a teaser image we never show
+        args = oemer_ete.get_parser().parse_args([image_path, "-o", os.path.dirname(image_path)])
         try:
-            oemer_ete.main()
-        except SystemExit:
-            pass
+            oemer_ete.clear_data()
+            oemer_ete.extract(args)
         except Exception as e:
-            raise RuntimeError(f"OMR Crash: {e}")
-        finally:
-            sys.argv = original_argv
+            raise RuntimeError(f"OMR Crash: {e}") from e
 
         # Check outputs
         possible_files = [
@@ -157,22 +390,191 @@ class MusicConverter:
             
         raise FileNotFoundError("AI failed to generate MusicXML. Try a clearer image.")
 
+    @classmethod
+    def _midi_parser(cls):
+        """
+        partitura converts MusicXML -> MIDI orders of magnitude faster than music21.
+        Imported once per process; None when it is not installed.
+        """
+        if cls._parser is False:
+            try:
+                import partitura
+                cls._parser = partitura
+            except ImportError:
+                cls._parser = None
+        return cls._parser
+
+    def write_midi(self, xml_path, midi_path):
+        parser = self._midi_parser()
+        if parser is not None:
+            try:
+                parser.save_score_midi(parser.load_musicxml(xml_path), midi_path)
+                return
+            except Exception as e:
+                print(f"⚠️ partitura could not convert the score, falling back to music21: {e}")
+
+        # Deferred: music21 alone pulls in hundreds of submodules (1-2s) and is only a fallback.
+        # After the first call these imports are sys.modules lookups.
+        from music21 import converter
+        from music21.exceptions21 import Music21Exception
+
+        try:
+            converter.parse(xml_path).write('midi', fp=midi_path)
+        except (Music21Exception, ParseError) as e:
+            raise ValueError("Could not parse music notation.") from e
+
     def generate_audio(self, xml_path):
+        """
+        MusicXML file -> MP3 bytes. The encoded stream is read straight from ffmpeg's stdout;
+        the only consumer is the browser, so no MP3 file is written.
+        """
         midi_path = xml_path.replace(".musicxml", ".mid")
-        wav_path = xml_path.replace(".musicxml", ".wav")
-        mp3_path = xml_path.replace(".musicxml", ".mp3")
 
+        self.write_midi(xml_path, midi_path)
+
+        # Render at a reduced sample rate (plenty for score playback, half the synthesis work)
+        # and stream FluidSynth's raw PCM straight into ffmpeg: no WAV round-trip through disk.
+        # Its stderr goes to a file: nobody reads a pipe until ffmpeg is done, and a full
+        # stderr pipe (e.g. repeated "No preset found") would stall the PCM stream.
+        synth_err = tempfile.TemporaryFile()
+        synth = subprocess.Popen(
+            ["fluidsynth", "-ni", "-q", "-r", str(AUDIO_SAMPLE_RATE),
+             "-T", "raw", "-O", "s16", "-E", "little", "-F", "-",
+             self.soundfont, midi_path],
+            stdout=subprocess.PIPE, stderr=synth_err)
+        # (FluidSynth always renders stereo, so downmix to mono here; LAME VBR -q:a 5 sizes the
+        # bitrate to the content instead of a fixed 128k, which is oversized for 22 kHz mono)
+        encoder = subprocess.Popen(
+            ["ffmpeg", "-y", "-loglevel", "error",
+             "-f", "s16le", "-ar", str(AUDIO_SAMPLE_RATE), "-ac", "2", "-i", "-",
+             *MP3_ENCODER_ARGS, "-f", "mp3", "-"],
+            stdin=synth.stdout, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        synth.stdout.close()  # ffmpeg owns the read end now
+        mp3_bytes, encoder_err = encoder.communicate()
+        synth.wait()
+        with synth_err:
+            synth_err.seek(0)
+            synth_msg = synth_err.read().decode(errors='replace').strip()
+
+        # Encoder first: if ffmpeg dies, FluidSynth fails with SIGPIPE and would hide the real error
+        if encoder.returncode != 0:
+            raise RuntimeError(f"Could not encode MP3 audio: {encoder_err.decode(errors='replace').strip()}")
+        if synth.returncode != 0:
+            raise RuntimeError(f"Could not synthesize audio: {synth_msg}")
+        return mp3_bytes
+
+@st.cache_resource(show_spinner=False)
+def get_converter():
+    # One converter per process: setup (oemer overlay, sys.path, downloads) only runs once
+    return MusicConverter()
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def package_version(name):
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+def config_key(*parts):
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()[:12]
+
+# Everything besides the input that changes a stage's output is salted into its result keys,
+# so e.g. USE_FP32_MODELS=1 or a new SoundFont never serves results made under the old setup.
+# Computed once per process: the package lookups would otherwise run on every rerun.
+@st.cache_resource(show_spinner=False)
+def omr_config_key():
+    return config_key(RESULTS_VERSION, package_version("oemer"), USE_FP32_MODELS, OMR_TARGET_PIXELS)
+
+@st.cache_resource(show_spinner=False)
+def audio_config_key():
+    return config_key(RESULTS_VERSION, importlib.util.find_spec("partitura") is not None,
+                      SOUNDFONT_URL, AUDIO_SAMPLE_RATE, MP3_ENCODER_ARGS)
+
+def result_path(name):
+    """Path of a stored result, or None. A hit counts as a use for prune_results."""
+    path = os.path.join(RESULTS_DIR, name)
+    if not os.path.exists(path): return None
+    os.utime(path)  # mtime doubles as "last served" for prune_results
+    return path
+
+def load_result(name):
+    path = result_path(name)
+    if path is None: return None
+    with open(path, "rb") as f:
+        return f.read()
+
+def store_result(name, data):
+    # Write-then-rename so a concurrent reader never sees a partial result
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=RESULTS_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f: f.write(data)
+    os.replace(tmp_path, os.path.join(RESULTS_DIR, name))
+    prune_results()
+
+def prune_results():
+    """
+    Drops results not served for RESULTS_MAX_AGE, then the least recently served ones
+    until the store fits in RESULTS_MAX_BYTES.
+    """
+    entries = []
+    for entry in os.scandir(RESULTS_DIR):
+        if entry.name.endswith(".tmp"): continue
         try:
-            s = converter.parse(xml_path)
-            s.write('midi', fp=midi_path)
-        except:
-            raise ValueError("Could not parse music notation.")
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue  # removed by a concurrent prune
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
 
-        fs = FluidSynth(self.soundfont)
-        fs.midi_to_audio(midi_path, wav_path)
-        
-        AudioSegment.from_wav(wav_path).export(mp3_path, format="mp3", bitrate="128k")
-        return mp3_path
+    entries.sort()
+    total_size = sum(size for _, size, _ in entries)
+    cutoff = time.time() - RESULTS_MAX_AGE
+    for mtime, size, path in entries:
+        if mtime >= cutoff and total_size <= RESULTS_MAX_BYTES: break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+# The pipeline is deterministic, so results are content-addressed: persisted on disk under
+# the SHA-256 of their input (survives restarts) and memoized in-process by st.cache_data
+# (underscored args are not hashed by Streamlit; the digest is the key).
+@st.cache_data(show_spinner=False)
+def cached_omr(file_hash, _file_bytes, file_name):
+    """
+    Upload bytes -> MusicXML text.
+    """
+    result_name = f"{file_hash}_{omr_config_key()}.musicxml"
+    xml_bytes = load_result(result_name)
+    if xml_bytes is None:
+        converter = get_converter()
+        # Private workspace per request: concurrent sessions never share files
+        with tempfile.TemporaryDirectory(prefix="score_") as temp_dir:
+            img_path = converter.prepare_image(_file_bytes, file_name, temp_dir)
+            xml_path = converter.run_omr(img_path)
+            with open(xml_path, "rb") as f:
+                xml_bytes = f.read()
+        store_result(result_name, xml_bytes)
+    return xml_bytes.decode("utf-8")
+
+def cached_audio(xml_hash, xml_content):
+    """
+    MusicXML text -> path of the MP3 in the results store.
+    Memoized on disk only: the existence check runs every time, so a pruned or cleaned
+    results dir regenerates the file instead of handing out a stale path.
+    """
+    result_name = f"{xml_hash}_{audio_config_key()}.mp3"
+    mp3_path = result_path(result_name)
+    if mp3_path is not None: return mp3_path
+
+    converter = get_converter()
+    with tempfile.TemporaryDirectory(prefix="score_") as temp_dir:
+        xml_path = os.path.join(temp_dir, "score.musicxml")
+        with open(xml_path, "w", encoding="utf-8") as f: f.write(xml_content)
+        store_result(result_name, converter.generate_audio(xml_path))
+    return os.path.join(RESULTS_DIR, result_name)
 
 # --- UI ---
 st.set_page_config(page_title="AI Sheet Music", page_icon="🎼")
@@ -182,32 +584,25 @@ st.write("Upload a PDF or Image.")
 uploaded_file = st.file_uploader("Upload Score", type=["pdf", "png", "jpg"])
 
 if uploaded_file:
-    temp_dir = "temp_workspace"
-    if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
-    os.makedirs(temp_dir, exist_ok=True)
-
     st.image(uploaded_file, caption="Preview", width="stretch")
 
     if st.button("▶️ Generate Audio"):
         status = st.status("Initializing...", expanded=True)
         try:
-            converter = MusicConverter()
-            
-            status.write("🖼️ Reading image...")
-            img_path = converter.prepare_image(uploaded_file.getvalue(), uploaded_file.name, temp_dir)
-            
+            get_converter()
+            file_bytes = uploaded_file.getvalue()
+
             status.write("🎼 Analyzing notes...")
-            xml_path = converter.run_omr(img_path)
-            
+            xml_content = cached_omr(content_hash(file_bytes), file_bytes, uploaded_file.name)
+
             status.write("🎹 Synthesizing audio...")
-            mp3_path = converter.generate_audio(xml_path)
-            
+            mp3_path = cached_audio(content_hash(xml_content.encode("utf-8")), xml_content)
+
             status.update(label="✅ Done!", state="complete", expanded=False)
             st.success("Success!")
-            
-            with open(mp3_path, "rb") as f:
-                st.audio(f.read(), format="audio/mp3")
-                
+
+            st.audio(mp3_path, format="audio/mp3")
+
         except Exception as e:
             status.update(label="❌ Failed", state="error")
             st.error(f"Error: {e}")